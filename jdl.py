@@ -1,5 +1,75 @@
-from copy import deepcopy
+import marshal
+import operator
+import os
+import sys
+from ast import literal_eval
 from functools import reduce
+from hashlib import sha1
+
+ARITHMETIC_OPS = frozenset({'+', '-', '*', '/', '%'})
+COMPARISON_OPS = frozenset({'==', '!=', '<', '>', '<=', '>=', '!->'})
+# Most scopes a function keeps for reuse, a function that doesn't recurse needs one
+SCOPE_POOL_SIZE = 4
+
+# Functions used to reduce a chain of operands, per instruction
+_ARITHMETIC_FUNCS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.truediv,
+    '%': operator.mod,
+}
+_COMPARISON_FUNCS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '>': operator.gt,
+    '<=': operator.le,
+    '>=': operator.ge,
+    '!->': lambda a, b: a not in b # I wish it will work
+}
+
+# Returned by Scope.lookup for names that aren't defined
+_MISSING = object()
+
+# Opcodes, used as indexes into Lang._DISPATCH
+(OP_EXIT, OP_VAR, OP_INT, OP_STR, OP_FLOAT, OP_BOOL, OP_FUNC, OP_RETURN,
+ OP_BREAK, OP_CONTINUE, OP_EXPORT, OP_IF, OP_WHILE, OP_FOR, OP_GET,
+ OP_PRINT, OP_INPUT, OP_ARRAY, OP_DICT, OP_INDEX, OP_LEN, OP_SWITCH,
+ OP_ARITH, OP_COMPARE, OP_NOT, OP_CALL, OP_AND, OP_OR, OP_FOR_REDUCE) = range(29)
+
+OPCODES = {
+    "exit": OP_EXIT,
+    "var": OP_VAR,
+    "int": OP_INT,
+    "str": OP_STR,
+    "float": OP_FLOAT,
+    "bool": OP_BOOL,
+    "func": OP_FUNC,
+    "return": OP_RETURN,
+    "break": OP_BREAK,
+    "continue": OP_CONTINUE,
+    "export": OP_EXPORT,
+    "if": OP_IF,
+    "while": OP_WHILE,
+    "for": OP_FOR,
+    "get": OP_GET,
+    "print": OP_PRINT,
+    "input": OP_INPUT,
+    "array": OP_ARRAY,
+    "dict": OP_DICT,
+    "index": OP_INDEX,
+    "len": OP_LEN,
+    "switch": OP_SWITCH,
+    **{op: OP_ARITH for op in ARITHMETIC_OPS},
+    **{op: OP_COMPARE for op in COMPARISON_OPS},
+    "not": OP_NOT,
+    "and": OP_AND,
+    "or": OP_OR,
+}
+
+# Instructions whose arguments are taken literally (names, type names...)
+RAW_ARGS_OPS = {OP_EXIT, OP_BREAK, OP_CONTINUE, OP_EXPORT, OP_GET, OP_INPUT}
 
 class ReturnValue(Exception):
     """Exception to handle function returns"""
@@ -15,12 +85,18 @@ class ContinueLoop(Exception):
     """Exception to handle continue statements"""
     pass
 
+# Raised by every break/continue, so they don't allocate an exception each
+_BREAK = BreakLoop()
+_CONTINUE = ContinueLoop()
+
 class ScopeException(Exception):
     """Exception to use with Scopes (if any error occurred)"""
     pass
 
 class CallFrame:
     """Represents a single frame in the call stack"""
+    __slots__ = ('name', 'instruction', 'line_number')
+    
     def __init__(self, name, instruction, line_number=None):
         self.name = name  # Function name or context (e.g., "main", "func1")
         self.instruction = instruction  # The instruction being executed
@@ -38,6 +114,8 @@ class CallFrame:
 
 class CallStack:
     """Manages the call stack for error tracebacks"""
+    __slots__ = ('frames',)
+    
     def __init__(self):
         self.frames = []
     
@@ -65,25 +143,48 @@ class CallStack:
         self.frames.clear()
 
 class Scope:
+    __slots__ = ('parent', 'locals', 'chain')
+    
     def __init__(self, parent=None):
         self.parent = parent
         self.locals = {}
+        # This scope's locals followed by every parent's, innermost first
+        self.chain = (self.locals,) + parent.chain if parent else (self.locals,)
+    
+    def rebind(self, parent):
+        """Reuse this (emptied) scope as a new child of parent"""
+        self.parent = parent
+        self.chain = (self.locals,) + parent.chain
+    
+    def release(self):
+        """Empty this scope and detach it from its parents, ready for rebind()"""
+        self.locals.clear()
+        self.parent = None
+        self.chain = None
     
     def set(self, name, value):
         self.locals[name] = value
     
     def get(self, name):
-        if name in self.locals:
-            value = self.locals[name]
-            if isinstance(value, Func):
-                return value
-            return deepcopy(value)
+        """Get a variable, looking through the parent scopes
         
-        if self.parent:
-            return self.parent.get(name)
+        Values are returned as they are, not copied: no instruction mutates
+        a list/dict in place, `var` always rebinds the name to a new value
+        """
+        for scope_locals in self.chain:
+            if name in scope_locals:
+                return scope_locals[name]
         
         raise NameError(f"Name '{name}' not defined")
     
+    def lookup(self, name):
+        """Like get, but returns _MISSING instead of raising for undefined names"""
+        for scope_locals in self.chain:
+            value = scope_locals.get(name, _MISSING)
+            if value is not _MISSING:
+                return value
+        return _MISSING
+    
     def export(self, *names):
         if self.parent:
             for name in names:
@@ -92,17 +193,18 @@ class Scope:
             raise ScopeException("Can't export a value to the Global Scope while already working in the global scope")
     
     def is_global_func_exists(self, funcname):
-        try:
-            value = self.get(funcname)
-            return isinstance(value, Func)
-        except NameError:
-            return False
+        return isinstance(self.lookup(funcname), Func)
 
 class Func:
+    __slots__ = ('params', 'body', 'name', 'scope_pool')
+    
     def __init__(self, params, body, name):
         self.params = params
         self.body = body
         self.name = name
+        # Emptied scopes of finished calls, reused by the next calls
+        # (at most SCOPE_POOL_SIZE of them)
+        self.scope_pool = []
     
     def __str__(self):
         return f"<func {self.name}({', '.join(self.params)})>"
@@ -110,374 +212,652 @@ class Func:
     def __repr__(self):
         return f"Func(name={self.name}, params={self.params})"
 
+class Block(tuple):
+    """A compiled sequence of instructions, ready to be run by Lang"""
+    __slots__ = ()
+
+class VarRef:
+    """A compiled "$name" variable reference
+    
+    Variables are looked up by name at runtime: functions run in a child
+    of the caller's scope, so where a name lives isn't known before that
+    """
+    __slots__ = ('name',)
+    
+    def __init__(self, name):
+        self.name = name
+    
+    def __repr__(self):
+        return f"VarRef({self.name!r})"
+
+def flatten_arithmetic(instr, args, values=None):
+    """Flatten deeply nested arithmetic operations for better performance"""
+    if values is None:
+        values = []
+    
+    for item in args:
+        if (isinstance(item, (list, tuple)) and len(item) > 0 and 
+            item[0] == instr):
+            flatten_arithmetic(instr, item[1:], values)
+        else:
+            values.append(item)
+    
+    return values
+
+def compile_value(value):
+    """Compile a value - nested instructions inside it become nodes"""
+    if isinstance(value, str) and value.startswith("$"):
+        return VarRef(intern_name(value[1:]))
+    elif isinstance(value, tuple) and len(value) > 0:
+        return compile_instruction(value)
+    elif isinstance(value, list):
+        return [compile_value(v) for v in value]
+    elif isinstance(value, dict):
+        return {k: compile_value(v) for k, v in value.items()}
+    else:
+        return value
+
+def intern_name(name):
+    """Intern a name so scope lookups can match it by identity"""
+    return sys.intern(name) if type(name) is str else name
+
+def compile_values(values):
+    return tuple(compile_value(v) for v in values)
+
+def compile_block(code):
+    """Compile a list of instructions into a Block"""
+    if not isinstance(code, (list, tuple)):
+        code = (code,)
+    return Block(compile_instruction(loc if type(loc) is tuple else (loc,)) for loc in code)
+
+def compile_switch(args):
+    """Compile switch arguments into (value, cases, default_block, jump_table)
+    
+    Each case is a tuple of (case_value, case_body) pairs, or None if it
+    wasn't a dict (reported when the switch reaches it).
+    When every case value is a literal, jump_table maps them to their
+    bodies (the first one wins, like the linear search), otherwise it's None
+    """
+    if len(args) < 2:
+        return args
+    
+    cases = []
+    for case_dict in args[1:-1]:  # all except the last argument
+        if isinstance(case_dict, dict):
+            cases.append(tuple(
+                (compile_value(case_value), compile_block(case_body))
+                for case_value, case_body in case_dict.items()
+            ))
+        else:
+            cases.append(None)
+    default_block = compile_block(args[-1]) if isinstance(args[-1], list) else None
+    
+    jump_table = {}
+    for case in cases:
+        if case is None:
+            jump_table = None
+            break
+        for case_value, case_body in case:
+            if type(case_value) is VarRef or (type(case_value) is tuple and case_value):
+                jump_table = None
+                break
+            jump_table.setdefault(case_value, case_body)
+        if jump_table is None:
+            break
+    
+    return (compile_value(args[0]), tuple(cases), default_block, jump_table)
+
+def compile_reduction(args):
+    """Match a for loop whose body only folds the items into one variable:
+    
+        ("for", "item", iterable, [("var", "acc", (op, "$acc", "$item"))])
+    
+    with op one of + - * / %. Such a loop is run as a single reduce() over
+    the items (see Lang._op_for_reduce), giving the same result as running
+    the body once per item. Returns its compiled arguments
+    (var_name, iterable, acc_name, op), or None for any other loop
+    """
+    if len(args) != 3:
+        return None
+    var_name, iterable, body = args
+    if not isinstance(body, (list, tuple)) or len(body) != 1:
+        return None
+    
+    statement = body[0]
+    if type(statement) is not tuple or len(statement) != 3 or statement[0] != "var":
+        return None
+    acc_name, expr = statement[1], statement[2]
+    if type(var_name) is not str or type(acc_name) is not str or acc_name == var_name:
+        return None
+    if type(expr) is not tuple or len(expr) == 0 or type(expr[0]) is not str or expr[0] not in ARITHMETIC_OPS:
+        return None
+    if flatten_arithmetic(expr[0], expr[1:]) != ["$" + acc_name, "$" + var_name]:
+        return None
+    
+    return (intern_name(var_name), compile_value(iterable), intern_name(acc_name), expr[0])
+
+def compile_instruction(loc):
+    """Lower a source instruction tuple into an (opcode, args, loc) node
+    
+    Nothing is validated here: malformed instructions still raise when
+    they are executed, like they always did
+    """
+    if len(loc) == 0:
+        return (OP_CALL, (loc,), loc)
+    
+    instr = intern_name(loc[0])
+    args = loc[1:]
+    op = OPCODES.get(instr, OP_CALL) if isinstance(instr, str) else OP_CALL
+    
+    if op in RAW_ARGS_OPS:
+        pass
+    elif op == OP_VAR:
+        args = tuple(intern_name(name) for name in args[:1]) + compile_values(args[1:])
+    elif op == OP_FUNC:
+        if len(args) == 3:
+            name, params, body = args
+            if isinstance(params, list):
+                params = [intern_name(param) for param in params]
+            args = (intern_name(name), params, compile_block(body))
+    elif op == OP_IF:
+        # a falsy else body is skipped, don't turn it into a statement
+        args = compile_values(args[:1]) + tuple(compile_block(body) if body else body for body in args[1:])
+    elif op == OP_WHILE:
+        args = compile_values(args[:1]) + tuple(compile_block(body) for body in args[1:])
+    elif op == OP_FOR:
+        reduction = compile_reduction(args)
+        if reduction is not None:
+            op, args = OP_FOR_REDUCE, reduction
+        else:
+            args = tuple(intern_name(name) for name in args[:1]) + compile_values(args[1:2]) + tuple(compile_block(body) for body in args[2:])
+    elif op == OP_SWITCH:
+        args = compile_switch(args)
+    elif op == OP_ARITH:
+        args = (instr, compile_values(flatten_arithmetic(instr, args)))
+    elif op == OP_COMPARE:
+        args = (instr, compile_values(args))
+    elif op == OP_CALL:
+        args = (instr,) + compile_values(args)
+    else:
+        args = compile_values(args)
+    
+    return (op, args, loc)
+
 class Lang:
-    def __init__(self, scope: Scope, code: tuple, call_stack=None, context_name="<string>"):
+    __slots__ = ('scope', 'code', 'call_stack', 'context_name')
+    
+    def __init__(self, scope: Scope, code, call_stack=None, context_name="<string>"):
         self.scope = scope
-        self.code = code
+        self.code = code if type(code) is Block else compile_block(code)
         self.call_stack = call_stack if call_stack is not None else CallStack()
         self.context_name = context_name
     
     def resolve_value(self, value):
         """Resolve a value - handle variable references, arrays, dicts"""
-        if isinstance(value, str) and value.startswith("$"):
-            return self.scope.get(value[1:])
-        elif isinstance(value, tuple) and len(value) > 0:
-            return self.execute_instruction(value)
-        elif isinstance(value, list):
-            return [self.resolve_value(v) for v in value]
-        elif isinstance(value, dict):
-            return {k: self.resolve_value(v) for k, v in value.items()}
+        value_type = type(value)
+        if value_type is VarRef:
+            return self.scope.get(value.name)
+        elif value_type is tuple:
+            # a compiled instruction (or an empty tuple literal)
+            return self._DISPATCH[value[0]](self, value[1]) if value else value
+        elif value_type is list:
+            # literal items are appended as they are, without a call each
+            result = []
+            for item in value:
+                item_type = type(item)
+                if item_type is VarRef:
+                    item = self.scope.get(item.name)
+                elif item_type is tuple or item_type is list or item_type is dict:
+                    item = self.resolve_value(item)
+                result.append(item)
+            return result
+        elif value_type is dict:
+            result = {}
+            for key, item in value.items():
+                item_type = type(item)
+                if item_type is VarRef:
+                    item = self.scope.get(item.name)
+                elif item_type is tuple or item_type is list or item_type is dict:
+                    item = self.resolve_value(item)
+                result[key] = item
+            return result
         else:
             return value
     
-    def flatten_arithmetic(self, instr, args):
-        """Flatten deeply nested arithmetic operations for better performance"""
-        ops = {
-            '+': lambda a, b: a + b,
-            '-': lambda a, b: a - b,
-            '*': lambda a, b: a * b,
-            '/': lambda a, b: a / b,
-            '%': lambda a, b: a % b,
-        }
+    def _op_exit(self, args):
+        if len(args) == 0:
+            raise SystemExit(0)
+        elif len(args) == 1:
+            raise SystemExit(args[0])
+        else:
+            raise ValueError("exit takes 1 optional argument")
+    
+    def _op_var(self, args):
+        if len(args) != 2:
+            raise SyntaxError("var takes 2 arguments")
+        name, value = args
+        resolved_value = self.resolve_value(value)
+        self.scope.set(name, resolved_value)
+        return resolved_value
+    
+    def _op_int(self, args):
+        if len(args) != 1:
+            raise SyntaxError("int takes 1 argument")
+        value = self.resolve_value(args[0])
+        return int(value)
+    
+    def _op_str(self, args):
+        if len(args) != 1:
+            raise SyntaxError("str takes 1 argument")
+        value = self.resolve_value(args[0])
+        return str(value)
+    
+    def _op_float(self, args):
+        if len(args) != 1:
+            raise SyntaxError("float takes 1 argument")
+        value = self.resolve_value(args[0])
+        return float(value)
+    
+    def _op_bool(self, args):
+        if len(args) != 1:
+            raise SyntaxError("bool takes 1 argument")
+        value = self.resolve_value(args[0])
+        return bool(value)
+    
+    def _op_func(self, args):
+        if len(args) != 3:
+            raise SyntaxError("func takes 3 arguments (name, params, body)")
+        name, params, body = args
+        func = Func(params, body, name)
+        self.scope.set(name, func)
+        return func
+    
+    def _op_return(self, args):
+        if len(args) == 0:
+            raise ReturnValue(None)
+        elif len(args) == 1:
+            value = self.resolve_value(args[0])
+            raise ReturnValue(value)
+        else:
+            values = tuple(self.resolve_value(a) for a in args)
+            raise ReturnValue(values)
+    
+    def _op_break(self, args):
+        # the traceback is dropped, or it would grow with every raise
+        raise _BREAK.with_traceback(None)
+    
+    def _op_continue(self, args):
+        raise _CONTINUE.with_traceback(None)
+    
+    def _op_export(self, args):
+        self.scope.export(*args,)
+    
+    def _op_if(self, args):
+        if len(args) < 2 or len(args) > 3:
+            raise SyntaxError("if takes 2 or 3 arguments (condition, then_body, [else_body])")
         
-        if instr not in ops:
-            return None
+        condition = self.resolve_value(args[0])
+        then_body = args[1]
+        else_body = args[2] if len(args) == 3 else None
         
-        stack = list(args)
-        values = []
+        if condition:
+            return self.run_block(then_body)
+        elif else_body:
+            return self.run_block(else_body)
+        return None
+    
+    def _op_while(self, args):
+        if len(args) != 2:
+            raise SyntaxError("while takes 2 arguments (condition, body)")
+        
+        condition_expr = args[0]
+        body = args[1]
+        result = None
+        
+        while True:
+            condition = self.resolve_value(condition_expr)
+            
+            if not condition:
+                break
+            
+            try:
+                result = self.run_block(body)
+            except BreakLoop:
+                break
+            except ContinueLoop:
+                continue
+        
+        return result
+    
+    def _op_for(self, args):
+        if len(args) != 3:
+            raise SyntaxError("for takes 3 arguments (var_name, iterable, body)")
+        
+        var_name = args[0]
+        # copied once, the body can't affect what is being iterated over
+        iterable = list(self.resolve_value(args[1]))
+        body = args[2]
+        result = None
         
-        while stack:
-            item = stack.pop(0)
+        for item in iterable:
+            self.scope.set(var_name, item)
             
-            if (isinstance(item, (list, tuple)) and len(item) > 0 and 
-                item[0] == instr):
-                stack = list(item[1:]) + stack
+            try:
+                result = self.run_block(body)
+            except BreakLoop:
+                break
+            except ContinueLoop:
+                continue
+        
+        return result
+    
+    def _op_for_reduce(self, args):
+        # A for loop matched by compile_reduction, the whole loop is one reduce()
+        var_name, iterable, acc_name, instr = args
+        iterable = list(self.resolve_value(iterable))
+        if not iterable:
+            return None
+        
+        result = reduce(_ARITHMETIC_FUNCS[instr], iterable, self.scope.get(acc_name))
+        self.scope.set(var_name, iterable[-1])
+        self.scope.set(acc_name, result)
+        return result
+    
+    def _op_get(self, args):
+        if len(args) != 1:
+            raise SyntaxError("get takes 1 argument")
+        return self.scope.get(args[0])
+    
+    def _op_print(self, args):
+        resolved = [self.resolve_value(a) for a in args]
+        # one write of the joined text, same output as print(*resolved, end='')
+        sys.stdout.write(' '.join(map(str, resolved)))
+        return resolved if len(resolved) > 1 else resolved[0]
+    
+    def _op_input(self, args):
+        if len(args) > 1:
+            raise SyntaxError("input takes no/one argument")
+        
+        if not args:
+            return input()
+        match args[0]:
+            case "int":   return int(input())
+            case "float": return float(input())
+            case "str":   return input()
+            case "bool":  return bool(input())
+            case _:
+                raise TypeError("unknown data type: " + str(args[0]))
+    
+    def _op_array(self, args):
+        return [self.resolve_value(arg) for arg in args]
+    
+    def _op_dict(self, args):
+        if len(args) % 2 != 0:
+            raise SyntaxError("dict requires even number of arguments (key-value pairs)")
+        result = {}
+        for i in range(0, len(args), 2):
+            key = self.resolve_value(args[i])
+            value = self.resolve_value(args[i + 1])
+            result[key] = value
+        return result
+    
+    def _op_index(self, args):
+        if len(args) != 2:
+            raise SyntaxError("index takes 2 arguments (container, index)")
+        container = self.resolve_value(args[0])
+        index = self.resolve_value(args[1])
+        return container[index]
+    
+    def _op_len(self, args):
+        if len(args) != 1:
+            raise SyntaxError("len takes 1 argument")
+        value = self.resolve_value(args[0])
+        return len(value)
+    
+    def _op_switch(self, args):
+        if len(args) < 2:
+            raise SyntaxError("switch expects at least 2 arguments (value, cases...)")
+        
+        value, cases, default_block, jump_table = args
+        value = self.resolve_value(value)
+        
+        if jump_table is not None:
+            try:
+                case_body = jump_table.get(value)
+            except TypeError:
+                case_body = None  # unhashable, can't be equal to a literal case
+            if case_body is not None:
+                return self.run_block(case_body)
+        else:
+            for case in cases:
+                if case is None:
+                    raise TypeError("Each case must be a dict like {value: [code]}")
+                
+                for case_value, case_body in case:
+                    if value == self.resolve_value(case_value):
+                        return self.run_block(case_body)
+        
+        # Default case
+        if default_block:
+            return self.run_block(default_block)
+        
+        return None
+    
+    def _op_arith(self, args):
+        instr, operands = args
+        
+        # Two operands is by far the most common case, compute it directly
+        if len(operands) == 2:
+            a = self.resolve_value(operands[0])
+            b = self.resolve_value(operands[1])
+            if instr == '+':
+                return a + b
+            elif instr == '-':
+                return a - b
+            elif instr == '*':
+                return a * b
+            elif instr == '/':
+                return a / b
             else:
-                values.append(self.resolve_value(item))
+                return a % b
         
-        return reduce(ops[instr], values)
+        values = [self.resolve_value(item) for item in operands]
+        return reduce(_ARITHMETIC_FUNCS[instr], values)
     
-    def execute_instruction(self, loc, line_number=None):
-        """Execute a single instruction and return its result"""
-        #print("DebugLOC:", loc)
-        instr = loc[0]
-        #print("DebugInstr:", instr)
-        args = loc[1:]
+    def _op_compare(self, args):
+        instr, operands = args
+        values = [self.resolve_value(a) for a in operands]
+        return reduce(_COMPARISON_FUNCS[instr], values)
+    
+    def _op_and(self, args):
+        if len(args) == 0:
+            raise SyntaxError("and takes at least 1 argument")
+        # Stop at the first falsy value, the rest isn't evaluated
+        for arg in args:
+            value = self.resolve_value(arg)
+            if not value:
+                return value
+        return value
+    
+    def _op_or(self, args):
+        if len(args) == 0:
+            raise SyntaxError("or takes at least 1 argument")
+        # Stop at the first truthy value, the rest isn't evaluated
+        for arg in args:
+            value = self.resolve_value(arg)
+            if value:
+                return value
+        return value
+    
+    def _op_not(self, args):
+        if len(args) != 1:
+            raise SyntaxError("not takes 1 argument")
+        return not self.resolve_value(args[0])
+    
+    def _op_call(self, args):
+        instr = args[0]
+        call_args = args[1:]
         
-        # Push current instruction to call stack
-        self.call_stack.push(self.context_name, loc, line_number)
+        func = self.scope.lookup(instr)
+        if isinstance(func, Func):
+            if len(call_args) != len(func.params):
+                raise SyntaxError(f"{instr} requires {len(func.params)} argument(s), got {len(call_args)}")
+            
+            if func.scope_pool:
+                func_scope = func.scope_pool.pop()
+                func_scope.rebind(self.scope)
+            else:
+                # first call, or a recursive one while the others are in use
+                func_scope = Scope(self.scope)
+            
+            for param, arg in zip(func.params, call_args):
+                resolved_arg = self.resolve_value(arg)
+                func_scope.locals[param] = resolved_arg
+            
+            # The body runs on this interpreter, switched to the function's scope
+            caller_scope, caller_context = self.scope, self.context_name
+            self.scope = func_scope
+            self.context_name = func.name
+            try:
+                self.run_block(func.body)
+                result = None
+            except ReturnValue as ret:
+                result = ret.value
+            finally:
+                self.scope, self.context_name = caller_scope, caller_context
+            if len(func.scope_pool) < SCOPE_POOL_SIZE:
+                func_scope.release()
+                func.scope_pool.append(func_scope)
+            return result
+        else: 
+            raise SyntaxError(f"Unknown instruction: {instr}")
+    
+    # Handler table indexed by opcode, must follow the order of the OP_* constants
+    _DISPATCH = (
+        _op_exit, _op_var, _op_int, _op_str, _op_float, _op_bool, _op_func,
+        _op_return, _op_break, _op_continue, _op_export, _op_if, _op_while,
+        _op_for, _op_get, _op_print, _op_input, _op_array, _op_dict,
+        _op_index, _op_len, _op_switch, _op_arith, _op_compare, _op_not,
+        _op_call, _op_and, _op_or, _op_for_reduce,
+    )
+    
+    def execute_node(self, node):
+        """Execute a single compiled instruction and return its result
         
+        Only run() reports errors, the frames recorded by the blocks an
+        error went through are dropped here so they don't show up in the
+        next traceback
+        """
         try:
-            match instr:
-                case "exit":
-                    if len(args) == 0:
-                        raise SystemExit(0)
-                    elif len(args) == 1:
-                        raise SystemExit(args[0])
-                    else:
-                        raise ValueError(f"{instr} takes 1 optional argument")
-                
-                case "var":
-                    if len(args) != 2:
-                        raise SyntaxError(f"{instr} takes 2 arguments")
-                    name, value = args
-                    resolved_value = self.resolve_value(value)
-                    self.scope.set(name, resolved_value)
-                    return resolved_value
-                
-                case "int":
-                    if len(args) != 1:
-                        raise SyntaxError("{instr} takes 1 argument")
-                    value = self.resolve_value(args[0])
-                    return int(value)
-                
-                case "str":
-                    if len(args) != 1:
-                        raise SyntaxError("{instr} takes 1 argument")
-                    value = self.resolve_value(args[0])
-                    return str(value)
-                
-                case "float":
-                    if len(args) != 1:
-                        raise SyntaxError("{instr} takes 1 argument")
-                    value = self.resolve_value(args[0])
-                    return float(value)
-                
-                case "bool":
-                    if len(args) != 1:
-                        raise SyntaxError("{instr} takes 1 argument")
-                    value = self.resolve_value(args[0])
-                    return bool(value)
-                
-                case "func":
-                    if len(args) != 3:
-                        raise SyntaxError(f"{instr} takes 3 arguments (name, params, body)")
-                    name, params, body = args
-                    func = Func(params, body, name)
-                    self.scope.set(name, func)
-                    return func
-                
-                case "return":
-                    if len(args) == 0:
-                        raise ReturnValue(None)
-                    elif len(args) == 1:
-                        value = self.resolve_value(args[0])
-                        raise ReturnValue(value)
-                    else:
-                        values = tuple(self.resolve_value(a) for a in args)
-                        raise ReturnValue(values)
-                
-                case "break":
-                    raise BreakLoop()
-                
-                case "continue":
-                    raise ContinueLoop()
-                
-                case "export":
-                    self.scope.export(*args,)
-                
-                case "if":
-                    if len(args) < 2 or len(args) > 3:
-                        raise SyntaxError(f"{instr} takes 2 or 3 arguments (condition, then_body, [else_body])")
-                    
-                    condition = self.resolve_value(args[0])
-                    then_body = args[1]
-                    else_body = args[2] if len(args) == 3 else None
-                    
-                    if condition:
-                        if isinstance(then_body, (list, tuple)):
-                            return Lang(self.scope, then_body, self.call_stack, self.context_name).run()
-                        else:
-                            return self.execute_instruction(then_body)
-                    elif else_body:
-                        if isinstance(else_body, (list, tuple)):
-                            return Lang(self.scope, else_body, self.call_stack, self.context_name).run()
-                        else:
-                            return self.execute_instruction(else_body)
-                    return None
-                
-                case "while":
-                    if len(args) != 2:
-                        raise SyntaxError(f"{instr} takes 2 arguments (condition, body)")
-                    
-                    condition_expr = args[0]
-                    body = args[1]
-                    result = None
-                    
-                    while True:
-                        if isinstance(condition_expr, tuple):
-                            condition = self.execute_instruction(condition_expr)
-                        else:
-                            condition = self.resolve_value(condition_expr)
-                        
-                        if not condition:
-                            break
-                        
-                        try:
-                            if isinstance(body, (list, tuple)):
-                                result = Lang(self.scope, body, self.call_stack, self.context_name).run()
-                            else:
-                                result = self.execute_instruction(body)
-                        except BreakLoop:
-                            break
-                        except ContinueLoop:
-                            continue
-                    
-                    return result
-                
-                case "for":
-                    if len(args) != 3:
-                        raise SyntaxError(f"{instr} takes 3 arguments (var_name, iterable, body)")
-                    
-                    var_name = args[0]
-                    iterable = self.resolve_value(args[1])
-                    body = args[2]
-                    result = None
-                    
-                    for item in iterable:
-                        self.scope.set(var_name, item)
-                        
-                        try:
-                            if isinstance(body, (list, tuple)):
-                                result = Lang(self.scope, body, self.call_stack, self.context_name).run()
-                            else:
-                                result = self.execute_instruction(body)
-                        except BreakLoop:
-                            break
-                        except ContinueLoop:
-                            continue
-                    
-                    return result
-                
-                case "get":
-                    if len(args) != 1:
-                        raise SyntaxError(f"{instr} takes 1 argument")
-                    return self.scope.get(args[0])
-                
-                case "print":
-                    resolved = [self.resolve_value(a) for a in args]
-                    print(*resolved, end='')
-                    return resolved if len(resolved) > 1 else resolved[0]
-                
-                case "input":
-                    if len(args) > 1:
-                        raise SyntaxError(f"{instr} takes no/one argument")
-                    
-                    if not args:
-                        return input()
-                    match args[0]:
-                        case "int":   return int(input())
-                        case "float": return float(input())
-                        case "str":   return input()
-                        case "bool":  return bool(input())
-                        case _:
-                            raise TypeError("unknown data type: " + str(args[0]))
-                
-                case "array":
-                    return [self.resolve_value(arg) for arg in args]
-                
-                case "dict":
-                    if len(args) % 2 != 0:
-                        raise SyntaxError("dict requires even number of arguments (key-value pairs)")
-                    result = {}
-                    for i in range(0, len(args), 2):
-                        key = self.resolve_value(args[i])
-                        value = self.resolve_value(args[i + 1])
-                        result[key] = value
-                    return result
-                
-                case "index":
-                    if len(args) != 2:
-                        raise SyntaxError(f"{instr} takes 2 arguments (container, index)")
-                    container = self.resolve_value(args[0])
-                    index = self.resolve_value(args[1])
-                    return container[index]
-                
-                case "len":
-                    if len(args) != 1:
-                        raise SyntaxError(f"{instr} takes 1 argument")
-                    value = self.resolve_value(args[0])
-                    return len(value)
-                
-                case "switch":
-                    if len(args) < 2:
-                        raise SyntaxError(f"{instr} expects at least 2 arguments (value, cases...)")
-                    
-                    value = self.resolve_value(args[0])
-                    cases = args[1:-1]  # all except the last argument
-                    default_block = args[-1] if isinstance(args[-1], list) else None
-                    
-                    executed = False
-                    
-                    for case_dict in cases:
-                        if not isinstance(case_dict, dict):
-                            raise TypeError("Each case must be a dict like {value: [code]}")
-                        
-                        for case_value, case_body in case_dict.items():
-                            case_value_resolved = self.resolve_value(case_value)
-                            if value == case_value_resolved:
-                                executed = True
-                                if isinstance(case_body, (list, tuple)):
-                                    return Lang(self.scope, case_body, self.call_stack, self.context_name).run()
-                                else:
-                                    return self.execute_instruction(case_body)
-                    
-                    # Default case
-                    if not executed and default_block:
-                        if isinstance(default_block, (list, tuple)):
-                            return Lang(self.scope, default_block, self.call_stack, self.context_name).run()
-                        else:
-                            return self.execute_instruction(default_block)
-                    
-                    return None
-                case _:
-                    
-                    if instr in ['+', '-', '*', '/', '%']:
-                        result = self.flatten_arithmetic(instr, args)
-                        if result is not None:
-                            return result
-                    
-                    if instr in ['==', '!=', '<', '>', '<=', '>=', 'and', 'or', 'not', "!->"]:
-                        if instr == 'not':
-                            if len(args) != 1:
-                                raise SyntaxError(f"{instr} takes 1 argument")
-                            return not self.resolve_value(args[0])
-                        
-                        values = [self.resolve_value(a) for a in args]
-                        
-                        ops = {
-                            '==': lambda a, b: a == b,
-                            '!=': lambda a, b: a != b,
-                            '<': lambda a, b: a < b,
-                            '>': lambda a, b: a > b,
-                            '<=': lambda a, b: a <= b,
-                            '>=': lambda a, b: a >= b,
-                            'and': lambda a, b: a and b,
-                            'or': lambda a, b: a or b,
-                            '!->': lambda a, b: a not in b # I wish it will work
-                        }
-                        return reduce(ops[instr], values)
-                    
-                    if self.scope.is_global_func_exists(instr):
-                        call_args = args
-                        func = self.scope.get(instr)
-                        
-                        if len(call_args) != len(func.params):
-                            raise SyntaxError(f"{instr} requires {len(func.params)} argument(s), got {len(call_args)}")
-                        
-                        func_scope = Scope(self.scope)
-                        
-                        for param, arg in zip(func.params, call_args):
-                            resolved_arg = self.resolve_value(arg)
-                            func_scope.locals[param] = resolved_arg
-                        
-                        func_lang = Lang(func_scope, func.body, self.call_stack, func.name)
-                        try:
-                            func_lang.run()
-                            return None
-                        except ReturnValue as ret:
-                            return ret.value
-                    else: 
-                        raise SyntaxError(f"Unknown instruction: {instr}")
+            return self._DISPATCH[node[0]](self, node[1])
+        except Exception:
+            self.call_stack.clear()
+            raise
+    
+    def execute_instruction(self, loc, line_number=None):
+        """Execute a single (uncompiled) instruction and return its result
         
-        finally:
-            # Pop the frame after execution (success or failure)
-            self.call_stack.pop()
+        line_number is accepted for compatibility and ignored
+        """
+        return self.execute_node(compile_instruction(loc))
     
-    def run(self):
+    def run_block(self, block):
+        """Run a compiled block in the current scope, return the last result"""
+        dispatch = self._DISPATCH
         result = None
-        i = 0
-        for loc in self.code:
-            try:
-                #TEMPORARY CODE
-                if type(loc).__name__ != "tuple":
-                    loc = (loc,)
-                #END
-               # print("DebugLOC2:", loc)
-                result = self.execute_instruction(loc, line_number=i+1)
-            except (ReturnValue, BreakLoop, ContinueLoop):
-                # These are control flow exceptions, re-raise them
-                raise
-            except Exception as e:
-                # For any other exception, print traceback and re-raise
-                error_name = type(e).__name__
-                error_desc = str(e)
-                traceback = self.call_stack.get_traceback()
-                
-                print(f"\n{error_name}: {error_desc}")
-                print(traceback)
-                raise SystemExit(1)
-            i += 1
+        try:
+            for line_number, node in enumerate(block, 1):
+                result = dispatch[node[0]](self, node[1])
+        except (ReturnValue, BreakLoop, ContinueLoop):
+            raise
+        except Exception:
+            # Only done when something failed: every block the error goes
+            # through records the statement it was running, innermost first
+            self.call_stack.push(self.context_name, node[2], line_number)
+            raise
         return result
+    
+    def run(self):
+        try:
+            return self.run_block(self.code)
+        except (ReturnValue, BreakLoop, ContinueLoop):
+            # These are control flow exceptions, re-raise them
+            raise
+        except Exception as e:
+            # For any other exception, print traceback and re-raise
+            error_name = type(e).__name__
+            error_desc = str(e)
+            # The frames were recorded while unwinding, show the outermost first
+            self.call_stack.frames.reverse()
+            traceback = self.call_stack.get_traceback()
+            self.call_stack.clear()
+            
+            print(f"\n{error_name}: {error_desc}")
+            print(traceback)
+            raise SystemExit(1)
+
+def load_program(path):
+    """Read and parse a program file
+    
+    The parsed program is cached with marshal (~/.cache/jdl), keyed by a
+    hash of the source, so literal_eval only runs when the file changed
+    """
+    with open(path, 'r') as f:
+        source = f.read()
+    
+    cache_dir = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "jdl")
+    cache_path = os.path.join(cache_dir, f"{sha1(source.encode()).hexdigest()}.{marshal.version}.marshal")
+    
+    try:
+        with open(cache_path, 'rb') as f:
+            return marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        pass  # not cached yet (or unreadable), parse it
+    
+    code = literal_eval(source)
+    
+    # written aside then moved, so a reader never sees half a file
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(tmp_path, 'wb') as f:
+            marshal.dump(code, f)
+        os.replace(tmp_path, cache_path)
+    except (OSError, ValueError):
+        # caching is best effort, but don't leave a half written file behind
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+    
+    return code
 
 if __name__ == "__main__":
     from sys import argv
-    from ast import literal_eval
+    from importlib.machinery import EXTENSION_SUFFIXES
+    from importlib.util import module_from_spec, spec_from_file_location
+    
+    # Prefer the compiled build of this file (cythonize -3 -i jdl.py), but
+    # only if it was built after this file was last changed
+    interpreter = sys.modules[__name__]
+    source = os.path.abspath(__file__)
+    module_name = os.path.splitext(os.path.basename(source))[0]
+    for suffix in EXTENSION_SUFFIXES:
+        build = os.path.splitext(source)[0] + suffix
+        if os.path.isfile(build) and os.path.getmtime(build) >= os.path.getmtime(source):
+            try:
+                spec = spec_from_file_location(module_name, build)
+                compiled = module_from_spec(spec)
+                spec.loader.exec_module(compiled)
+                interpreter = compiled
+            except ImportError:
+                pass
+            break
     
     if len(argv) - 1 != 1:
         exit(f"Expected one argument, {str(len(argv) - 1)} given")
     try:
-        with open(argv[1], 'r') as f:
-            Lang(Scope(), literal_eval(f.read()), context_name=argv[1]).run()
+        program = interpreter.load_program(argv[1])
+        interpreter.Lang(interpreter.Scope(), program, context_name=argv[1]).run()
     except FileNotFoundError:
         print(f"\nError: file {argv[1]} not found.")
\ No newline at end of file